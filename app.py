@@ -2,23 +2,42 @@ import sys, asyncio
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-import os, random, time, logging, pathlib
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
-from playwright.async_api import async_playwright
+import os, random, time, logging, logging.handlers, pathlib, hashlib, json, functools, queue, atexit
+from contextlib import asynccontextmanager
+import httpx
+import redis.asyncio as redis
+from typing import Annotated
+import msgspec
+from fastapi import FastAPI, HTTPException, Request
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+from selectolax.parser import HTMLParser
+from pythonjsonlogger import jsonlogger
 from dotenv import load_dotenv
 
 # ───── LOGS ─────
 LOG_DIR = pathlib.Path(__file__).with_name("logs")
 LOG_DIR.mkdir(exist_ok=True)
 
+# o loop só enfileira o registro; arquivo/console são escritos numa thread à parte
+_log_formatter = jsonlogger.JsonFormatter(
+    "%(asctime)s %(levelname)s %(name)s %(message)s", json_ensure_ascii=False
+)
+_log_handlers = [
+    logging.FileHandler(LOG_DIR / "checkout_bot.log", encoding="utf-8"),
+    logging.StreamHandler(),
+]
+for _h in _log_handlers:
+    _h.setFormatter(_log_formatter)
+
+log_queue = queue.Queue(-1)
+log_listener = logging.handlers.QueueListener(log_queue, *_log_handlers, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_DIR / "checkout_bot.log", encoding="utf-8"),
-        logging.StreamHandler(),
-    ],
+    format="%(message)s",   # o JSON é montado pelos handlers do listener
+    handlers=[logging.handlers.QueueHandler(log_queue)],
 )
 logger = logging.getLogger(__name__)
 
@@ -27,9 +46,18 @@ load_dotenv()
 CHECKOUT_URL      = os.getenv("CHECKOUT_URL", "https://naturalvalle.com.br/checkout/")
 ACTION_TIMEOUT_MS = int(os.getenv("ACTION_TIMEOUT_MS", "15000"))
 INSTANCE_NAME     = os.getenv("INSTANCE_NAME", "instancia-padrao")
+SITE_URL          = os.getenv("SITE_URL", "https://naturalvalle.com.br").rstrip("/")
+USE_BROWSER       = os.getenv("USE_BROWSER") == "1"   # fallback Playwright
+MAX_CONCURRENCY   = int(os.getenv("MAX_CONCURRENCY", "4"))
+PROD_CONCURRENCY  = int(os.getenv("PROD_CONCURRENCY", "4"))   # páginas de produto por pedido
+QUEUE_LIMIT       = int(os.getenv("QUEUE_LIMIT", "8"))          # pedidos aguardando vaga
+HUMAN_JITTER      = bool(os.getenv("HUMAN_JITTER"))     # atrasos aleatórios anti-bot
+REDIS_URL         = os.getenv("REDIS_URL")              # cache de produtos (opcional)
+PRODUCT_CACHE_TTL = int(os.getenv("PRODUCT_CACHE_TTL", "3600"))
 
 # ───── MODELOS ─────
-class CheckoutInfo(BaseModel):
+# msgspec valida direto do JSON cru, sem passar pelo pydantic a cada pedido
+class CheckoutInfo(msgspec.Struct, frozen=True, kw_only=True):
     email: str
     first_name: str
     last_name: str
@@ -40,158 +68,441 @@ class CheckoutInfo(BaseModel):
     address_2: str | None = ""
     neighborhood: str
     city: str
-    state: str = Field(..., min_length=2, max_length=2)
+    state: Annotated[str, msgspec.Meta(min_length=2, max_length=2)]
     phone: str
 
-class Payload(BaseModel):
+class Payload(msgspec.Struct, frozen=True):
     produtos: list[str]
     checkout: CheckoutInfo
 
 # ───── FASTAPI ─────
 app = FastAPI(title="Checkout‑Bot Python")
 
+BLOCKED_RESOURCES = {"image", "font", "media", "stylesheet"}
+BLOCKED_DOMAINS   = ("googletagmanager", "google-analytics", "facebook.net", "hotjar", "clarity.ms")
+
+async def block_heavy_requests(route):
+    req = route.request
+    if req.resource_type in BLOCKED_RESOURCES or any(d in req.url for d in BLOCKED_DOMAINS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def new_browser_context(browser):
+    context = await browser.new_context(
+        java_script_enabled=True,
+        bypass_csp=True,
+        ignore_https_errors=True,
+        service_workers="block",
+    )
+    # nada de imagens, fontes, CSS ou analytics: só o necessário para o carrinho
+    await context.route("**/*", block_heavy_requests)
+    return context
+
+@app.on_event("startup")
+async def startup():
+    # pool HTTP/2 único para o site; o HEAD já resolve DNS e fecha o handshake TLS
+    app.state.http_transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+    )
+    app.state.http = httpx.AsyncClient(
+        transport=app.state.http_transport,
+        base_url=SITE_URL,
+        timeout=ACTION_TIMEOUT_MS / 1000,
+    )
+    try:
+        await app.state.http.head("/")
+        logger.info("🔥 Conexão com %s aquecida", SITE_URL)
+    except httpx.HTTPError as e:
+        logger.warning("⚠️ Falha ao aquecer conexão com %s: %s", SITE_URL, e)
+
+    app.state.redis = redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+
+    if USE_BROWSER:
+        # um único Chromium para o processo inteiro + N contextos reaproveitáveis
+        app.state.playwright = await async_playwright().start()
+        app.state.browser = await app.state.playwright.chromium.launch(headless=True, channel="chromium-headless-shell")
+        app.state.contexts = asyncio.Queue()
+        for _ in range(MAX_CONCURRENCY):
+            app.state.contexts.put_nowait(await new_browser_context(app.state.browser))
+        logger.info("🧭 Navegador iniciado com %s contextos", MAX_CONCURRENCY)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await app.state.http.aclose()
+    if app.state.redis is not None:
+        await app.state.redis.aclose()
+
+    if USE_BROWSER:
+        await app.state.browser.close()
+        await app.state.playwright.stop()
+        logger.info("🔒 Navegador fechado")
+
 async def human_delay(a=0.3, b=0.8):
-    await asyncio.sleep(random.uniform(a, b))
+    if HUMAN_JITTER:
+        await asyncio.sleep(random.uniform(a, b))
 
+@functools.lru_cache(maxsize=1024)   # poucas quantidades distintas (0,05 / 0,10 / 1,00…)
 def normalize_qty(q: str) -> str:
     return f"{float(q.replace(',', '.')):.2f}"
 
+def is_order_received(url: str) -> bool:
+    return any(s in url for s in ("pedido-recebido", "order-received", "thank-you"))
+
+def billing_mapping(c: CheckoutInfo) -> dict[str, str]:
+    return {
+        "billing_email": c.email,
+        "billing_first_name": c.first_name,
+        "billing_last_name": c.last_name,
+        "billing_cpf": c.cpf,
+        "billing_postcode": c.cep,
+        "billing_address_1": c.address_1,
+        "billing_number": c.number,
+        "billing_address_2": c.address_2 or "",
+        "billing_neighborhood": c.neighborhood,
+        "billing_city": c.city,
+        "billing_phone": c.phone,
+    }
+
 async def process_request(data: Payload):
-    async with async_playwright() as p:
-        logger.info("🟢 Iniciando processo para instância: %s", INSTANCE_NAME)
+    if USE_BROWSER:
+        return await process_request_browser(data)
+    return await process_request_http(data)
 
-        browser = await p.chromium.launch(headless=True, slow_mo=300)
-        context = await browser.new_context()
-        page = await context.new_page()
-        page.set_default_timeout(ACTION_TIMEOUT_MS)
+# ───── HTTP DIRETO (wc-ajax) ─────
+def wc_ajax_url(endpoint: str) -> str:
+    return f"{SITE_URL}/?wc-ajax={endpoint}"
 
-        result = {"items": [], "checkout": "pending"}
+async def fetch_product_meta(client: httpx.AsyncClient, url: str) -> dict[str, str]:
+    """Lê product_id e SKU do formulário de compra da página do produto."""
+    r = await client.get(url)
+    r.raise_for_status()
+    tree = HTMLParser(r.text)
 
-        try:
-            for linha in data.produtos:
-                try:
-                    url, qty_raw = linha.rsplit(':', 1)
-                except ValueError:
-                    logger.warning("❗ Formato inválido na linha: %s", linha)
-                    continue
-
-                qty = normalize_qty(qty_raw)
-                logger.info("➡️ Abrindo %s (qty=%s)", url, qty)
-
-                try:
-                    await page.goto(url)
-                    logger.info("🌐 Página carregada")
-                except Exception as e:
-                    logger.error("❌ Falha ao carregar página %s: %s", url, e)
-                    continue
-
-                try:
-                    await page.fill("input.qty", qty)
-                    await human_delay()
-                    async with page.expect_response(lambda r: "wc-ajax" in r.url and r.status == 200):
-                        await page.click('button[name="add-to-cart"]')
-                    logger.info("✅ Produto adicionado ao carrinho: %s", url)
-                    result["items"].append({"url": url, "qty": qty, "added": True})
-                except Exception as e:
-                    logger.warning("⚠️ Falha ao adicionar produto: %s — %s", url, e)
-                    html = await page.content()
-                    if "não pode adicionar a quantidade" in html:
-                        logger.warning("🚫 Produto sem estoque: %s", url)
-                    result["items"].append({"url": url, "qty": qty, "added": False})
-                    continue
+    node = (tree.css_first('form.cart [name="add-to-cart"]')
+            or tree.css_first('form.cart input[name="product_id"]'))
+    product_id = node.attributes.get("value") if node else None
+    if not product_id:
+        raise ValueError(f"product_id não encontrado em {url}")
 
-                await human_delay(0.5, 1.2)
+    sku_node = tree.css_first(".product_meta .sku") or tree.css_first(".sku")
+    sku = sku_node.text(strip=True) if sku_node else ""
+
+    variation = tree.css_first('form.cart input[name="variation_id"]')
+    variation_id = (variation.attributes.get("value") or "") if variation else ""
+    return {"product_id": product_id, "sku": sku, "variation_id": variation_id}
 
-            logger.info("🛒 Indo para o checkout: %s", CHECKOUT_URL)
+async def get_product_meta(client: httpx.AsyncClient, url: str) -> dict[str, str]:
+    """fetch_product_meta com cache no Redis (prod:<sha1(url)>), se configurado."""
+    cache = app.state.redis
+    if cache is None:
+        return await fetch_product_meta(client, url)
+
+    key = f"prod:{hashlib.sha1(url.encode()).hexdigest()}"
+    try:
+        cached = await cache.get(key)
+        if cached:
+            return json.loads(cached)
+    except redis.RedisError as e:
+        logger.warning("⚠️ Redis indisponível, lendo página do produto: %s", e)
+
+    meta = await fetch_product_meta(client, url)
+    try:
+        await cache.set(key, json.dumps(meta), ex=PRODUCT_CACHE_TTL)
+    except redis.RedisError as e:
+        logger.warning("⚠️ Falha ao gravar cache do produto %s: %s", url, e)
+    return meta
+
+def checkout_form_fields(html: str) -> dict[str, str]:
+    """Campos já presentes no form de checkout (nonce, frete, hidden inputs)."""
+    tree = HTMLParser(html)
+    fields = {}
+    for node in tree.css("form.checkout input[name]"):
+        attrs = node.attributes
+        if attrs.get("type") in ("radio", "checkbox") and "checked" not in attrs:
+            continue
+        fields[attrs["name"]] = attrs.get("value") or ""
+    return fields
+
+@asynccontextmanager
+async def order_session():
+    """Client com cookies próprios (o carrinho) sobre o pool compartilhado.
+
+    Não é fechado ao sair: fechar o client fecharia o transport do app.
+    """
+    yield httpx.AsyncClient(
+        transport=app.state.http_transport,
+        base_url=SITE_URL,
+        cookies=httpx.Cookies(),
+        follow_redirects=True,
+        timeout=ACTION_TIMEOUT_MS / 1000,
+    )
+
+async def process_request_http(data: Payload):
+    logger.info("🟢 Iniciando processo (HTTP) para instância: %s", INSTANCE_NAME)
+    result = {"items": [], "checkout": "pending"}
+
+    # o carrinho do WooCommerce vive nos cookies da sessão: um client por pedido
+    async with order_session() as client:
+        for linha in data.produtos:
             try:
-                await page.goto(CHECKOUT_URL)
+                url, qty_raw = linha.rsplit(':', 1)
+            except ValueError:
+                logger.warning("❗ Formato inválido na linha: %s", linha)
+                continue
+
+            qty = normalize_qty(qty_raw)
+            logger.info("➡️ Adicionando %s (qty=%s)", url, qty)
+
+            try:
+                meta = await get_product_meta(client, url)
             except Exception as e:
-                logger.error("❌ Falha ao acessar página de checkout: %s", e)
-                raise
-
-            c = data.checkout
-            mapping = {
-                "billing_email": c.email,
-                "billing_first_name": c.first_name,
-                "billing_last_name": c.last_name,
-                "billing_cpf": c.cpf,
-                "billing_postcode": c.cep,
-                "billing_address_1": c.address_1,
-                "billing_number": c.number,
-                "billing_address_2": c.address_2 or "",
-                "billing_neighborhood": c.neighborhood,
-                "billing_city": c.city,
-                "billing_phone": c.phone,
-            }
-
-            for field, value in mapping.items():
-                try:
-                    await page.fill(f"#{field}", value)
-                    logger.info("✍️ Preenchido: %s", field)
-                except Exception as e:
-                    logger.warning("⚠️ Erro ao preencher %s: %s", field, e)
-                await human_delay(0.2, 0.6)
+                logger.error("❌ Falha ao ler dados do produto %s: %s", url, e)
+                continue
+
+            form = {"product_id": meta["product_id"], "product_sku": meta["sku"], "quantity": qty}
+            if meta.get("variation_id"):
+                form["variation_id"] = meta["variation_id"]
 
             try:
-                await page.click("#select2-billing_state-container")
-                await human_delay(0.4, 0.7)
-                await page.fill(".select2-search__field", "São Paulo")
-                await page.keyboard.press("Enter")
-                await human_delay(0.4, 0.7)
-                await page.click("#select2-billing_state-container")
-                await page.fill(".select2-search__field", "São Paulo")
-                await page.keyboard.press("Enter")
-                logger.info("📍 Estado 'São Paulo' selecionado com dupla verificação")
+                r = await client.post(wc_ajax_url("add_to_cart"), data=form)
+                r.raise_for_status()
+                body = r.json()
+                if not body or body.get("error"):
+                    raise ValueError("WooCommerce recusou o item")
+                logger.info("✅ Produto adicionado ao carrinho: %s", url)
+                result["items"].append({"url": url, "qty": qty, "added": True})
             except Exception as e:
-                logger.warning("⚠️ Falha ao selecionar estado 'São Paulo': %s", e)
+                logger.warning("⚠️ Falha ao adicionar produto: %s — %s", url, e)
+                result["items"].append({"url": url, "qty": qty, "added": False})
+
+        logger.info("🛒 Indo para o checkout: %s", CHECKOUT_URL)
+        try:
+            r = await client.get(CHECKOUT_URL)
+            r.raise_for_status()
+        except Exception as e:
+            logger.error("❌ Falha ao acessar página de checkout: %s", e)
+            raise
+
+        form = checkout_form_fields(r.text)
+        if "woocommerce-process-checkout-nonce" not in form:
+            logger.error("❌ Nonce do checkout não encontrado na página.")
+            raise HTTPException(status_code=500, detail="Nonce do checkout não encontrado.")
+
+        form.update(billing_mapping(data.checkout))
+        form.update(billing_country="BR", billing_state="SP", payment_method="asaas-pix")
+
+        r = await client.post(wc_ajax_url("checkout"), data=form)
+        try:
+            body = r.json()
+        except ValueError:
+            body = {}
+        if body.get("result") != "success":
+            logger.error("❌ Erro retornado pelo checkout WooCommerce: %s", body.get("messages", r.text[:500]))
+            raise HTTPException(status_code=500, detail="Erro ao processar pedido na página WooCommerce.")
+
+        result["checkout"] = "pedido_enviado"
+        result["redirect_url"] = body.get("redirect")
+        logger.info("🔁 Página final após envio: %s", result["redirect_url"])
+
+    return result
+
+# ───── PLAYWRIGHT (USE_BROWSER=1) ─────
+# dispara input/change para manter os listeners do WooCommerce (CEP, frete…)
+FILL_FIELDS_JS = """
+(map) => {
+    const missing = [];
+    for (const [id, val] of Object.entries(map)) {
+        const el = document.getElementById(id);
+        if (!el) { missing.push(id); continue; }
+        el.value = val;
+        el.dispatchEvent(new Event('input', {bubbles: true}));
+        el.dispatchEvent(new Event('change', {bubbles: true}));
+    }
+    return missing;
+}
+"""
 
-            html = await page.content()
-            if "Ocorreu um erro ao processar seu pedido" in html:
-                logger.error("❌ Erro detectado na tela de checkout. Abortando envio.")
-                raise HTTPException(status_code=500, detail="Erro ao processar pedido na página WooCommerce.")
+async def add_product_browser(context, linha: str, sem: asyncio.Semaphore,
+                              cart_lock: asyncio.Lock) -> dict | None:
+    try:
+        url, qty_raw = linha.rsplit(':', 1)
+    except ValueError:
+        logger.warning("❗ Formato inválido na linha: %s", linha)
+        return None
 
+    qty = normalize_qty(qty_raw)
+    async with sem:
+        page = await context.new_page()
+        page.set_default_timeout(ACTION_TIMEOUT_MS)
+        try:
+            logger.info("➡️ Abrindo %s (qty=%s)", url, qty)
             try:
-                radio_checked = await page.is_checked("#payment_method_asaas-pix")
-                if not radio_checked:
-                    await page.check("#payment_method_asaas-pix")
-                    logger.info("✅ PIX selecionado manualmente")
-                else:
-                    logger.info("✅ PIX já estava selecionado")
+                await page.goto(url)
+                logger.info("🌐 Página carregada")
             except Exception as e:
-                logger.warning("⚠️ Falha ao verificar ou selecionar PIX: %s", e)
+                logger.error("❌ Falha ao carregar página %s: %s", url, e)
+                return None
 
             try:
-                await page.click("#place_order")
-                logger.info("🚀 Botão de finalizar pedido clicado")
-                await human_delay(6, 20)
-                final_url = page.url
-                result["checkout"] = "pedido_enviado"
-                result["redirect_url"] = final_url
-                logger.info("🔁 Página final após envio: %s", final_url)
+                await page.fill("input.qty", qty)
+                # a sessão do WooCommerce não aguenta add_to_cart simultâneos:
+                # só o clique é serializado, o carregamento das páginas não
+                async with cart_lock:
+                    async with page.expect_response(lambda r: "wc-ajax" in r.url and r.status == 200):
+                        await page.click('button[name="add-to-cart"]')
+                logger.info("✅ Produto adicionado ao carrinho: %s", url)
+                await human_delay(0.5, 1.2)
+                return {"url": url, "qty": qty, "added": True}
             except Exception as e:
-                logger.error("❌ Erro ao clicar no botão 'Fazer Pedido' ou redirecionar: %s", e)
-                raise HTTPException(status_code=500, detail="Falha ao finalizar o pedido ou redirecionar.")
+                logger.warning("⚠️ Falha ao adicionar produto: %s — %s", url, e)
+                if await page.locator("text=não pode adicionar a quantidade").count():
+                    logger.warning("🚫 Produto sem estoque: %s", url)
+                return {"url": url, "qty": qty, "added": False}
+        finally:
+            await page.close()
+
+async def select_billing_state(page):
+    try:
+        # direto no <select> nativo; o change via jQuery atualiza o select2 e o frete
+        await page.select_option("#billing_state", value="SP", timeout=5000)
+        await page.evaluate("() => window.jQuery && jQuery('#billing_state').trigger('change')")
+        logger.info("📍 Estado 'São Paulo' selecionado")
+    except PlaywrightTimeoutError:
+        logger.info("↩️ Select nativo indisponível, usando o select2")
+        for _ in range(2):
+            await page.click("#select2-billing_state-container")
+            await page.fill(".select2-search__field", "São Paulo")
+            await page.wait_for_selector(".select2-results__option--highlighted")
+            await page.keyboard.press("Enter")
+        logger.info("📍 Estado 'São Paulo' selecionado com dupla verificação")
 
+async def process_request_browser(data: Payload):
+    logger.info("🟢 Iniciando processo para instância: %s", INSTANCE_NAME)
+
+    # contexto pré-aquecido do pool (ver startup); espera se todos estiverem em uso
+    context = await app.state.contexts.get()
+    page = await context.new_page()
+    page.set_default_timeout(ACTION_TIMEOUT_MS)
+
+    result = {"items": [], "checkout": "pending"}
+
+    try:
+        # produtos em páginas paralelas do mesmo contexto (mesmo carrinho)
+        sem = asyncio.Semaphore(PROD_CONCURRENCY)
+        cart_lock = asyncio.Lock()
+        results = await asyncio.gather(
+            *(add_product_browser(context, linha, sem, cart_lock) for linha in data.produtos),
+            return_exceptions=True,
+        )
+        for linha, item in zip(data.produtos, results):
+            if isinstance(item, BaseException):
+                logger.error("❌ Erro inesperado no produto %s: %s", linha, item)
+            elif item is not None:
+                result["items"].append(item)
+
+        logger.info("🛒 Indo para o checkout: %s", CHECKOUT_URL)
+        try:
+            await page.goto(CHECKOUT_URL)
         except Exception as e:
-            logger.exception("❌ Erro geral durante o processo")
+            logger.error("❌ Falha ao acessar página de checkout: %s", e)
             raise
 
-        finally:
-            await asyncio.sleep(10)
-            await context.close()
-            await browser.close()
-            logger.info("🔒 Navegador fechado")
+        mapping = billing_mapping(data.checkout)
+
+        # todos os campos numa única ida ao navegador; devolve os ids ausentes
+        missing = await page.evaluate(FILL_FIELDS_JS, mapping)
+        logger.info("✍️ Preenchidos: %s", ", ".join(f for f in mapping if f not in missing))
+        for field in missing:
+            logger.warning("⚠️ Campo não encontrado no checkout: %s", field)
+
+        try:
+            await select_billing_state(page)
+        except Exception as e:
+            logger.warning("⚠️ Falha ao selecionar estado 'São Paulo': %s", e)
 
-        return result
+        checkout_error = page.locator(".woocommerce-error, .woocommerce-NoticeGroup-checkout")
+        if await checkout_error.filter(has_text="Ocorreu um erro ao processar").count():
+            logger.error("❌ Erro detectado na tela de checkout. Abortando envio.")
+            raise HTTPException(status_code=500, detail="Erro ao processar pedido na página WooCommerce.")
+
+        try:
+            radio_checked = await page.is_checked("#payment_method_asaas-pix")
+            if not radio_checked:
+                await page.check("#payment_method_asaas-pix")
+                logger.info("✅ PIX selecionado manualmente")
+            else:
+                logger.info("✅ PIX já estava selecionado")
+        except Exception as e:
+            logger.warning("⚠️ Falha ao verificar ou selecionar PIX: %s", e)
+
+        try:
+            async with page.expect_navigation(url=is_order_received, timeout=30000):
+                await page.click("#place_order")
+                logger.info("🚀 Botão de finalizar pedido clicado")
+            final_url = page.url
+            result["checkout"] = "pedido_enviado"
+            result["redirect_url"] = final_url
+            logger.info("🔁 Página final após envio: %s", final_url)
+        except Exception as e:
+            logger.error("❌ Erro ao clicar no botão 'Fazer Pedido' ou redirecionar: %s", e)
+            raise HTTPException(status_code=500, detail="Falha ao finalizar o pedido ou redirecionar.")
+
+        # deixa os XHRs finais da página de obrigado terminarem antes de devolver o contexto
+        try:
+            await page.wait_for_load_state("networkidle", timeout=5000)
+        except PlaywrightTimeoutError:
+            logger.info("⌛ Página final ainda com requisições pendentes, seguindo")
+
+    except Exception as e:
+        logger.exception("❌ Erro geral durante o processo")
+        raise
+
+    finally:
+        await page.close()
+        await context.clear_cookies()
+        app.state.contexts.put_nowait(context)
+        logger.info("🔒 Contexto devolvido ao pool")
+
+    return result
+
+# ───── ADMISSÃO ─────
+# mesmo tamanho do pool de contextos: no máximo MAX_CONCURRENCY pedidos rodando
+_sem = asyncio.Semaphore(MAX_CONCURRENCY)
+_waiting = 0
+
+@asynccontextmanager
+async def admission():
+    global _waiting
+    if _sem.locked() and _waiting >= QUEUE_LIMIT:
+        logger.warning("⏳ Fila cheia (%s aguardando), recusando pedido", _waiting)
+        raise HTTPException(status_code=503, detail="Servidor ocupado, tente novamente.",
+                            headers={"Retry-After": "10"})
+    _waiting += 1
+    try:
+        await _sem.acquire()
+    finally:
+        _waiting -= 1
+    try:
+        yield
+    finally:
+        _sem.release()
 
 @app.post("/checkout")
-async def checkout_endpoint(payload: Payload):
+async def checkout_endpoint(request: Request):
     t0 = time.time()
     try:
-        result = await process_request(payload)
-        result.update(status="success", duration_ms=int((time.time() - t0) * 1000))
-        logger.info("✔ Pedido concluído em %sms", result["duration_ms"])
-        return result
-    except Exception as e:
-        logger.error("✖ Falha geral: %s", e, exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        payload = msgspec.json.decode(await request.body(), type=Payload)
+    except msgspec.DecodeError as e:   # inclui ValidationError
+        raise HTTPException(status_code=422, detail=str(e))
+
+    async with admission():
+        try:
+            result = await process_request(payload)
+            result.update(status="success", duration_ms=int((time.time() - t0) * 1000))
+            logger.info("✔ Pedido concluído em %sms", result["duration_ms"])
+            return result
+        except Exception as e:
+            logger.error("✖ Falha geral: %s", e, exc_info=True)
+            raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -7,13 +7,15 @@ Cria (ou sobrescreve) debug_bundle.txt contendo o conteúdo
 dos arquivos relevantes do projeto.
 """
 
+import os
 import pathlib
 import datetime
+import shutil
 
 # 1. Configurações -----------------------------------------------
 
 # extensões/nomes que queremos salvar
-KEEP_EXT  = {".py", ".txt", ".md", ".env", ".toml", ".yaml", ".yml"}
+KEEP_EXT  = frozenset({".py", ".txt", ".md", ".env", ".toml", ".yaml", ".yml"})
 KEEP_FILE = {"Dockerfile", "requirements.txt", ".env.example"}
 
 # pastas que NÃO queremos percorrer
@@ -25,10 +27,18 @@ OUT_FILE = pathlib.Path("debug_bundle.txt")
 
 # 2. Funções utilitárias ------------------------------------------
 
+def walk(directory):
+    """Percorre a árvore sem sequer entrar nas pastas de SKIP_DIR."""
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in SKIP_DIR:
+                    yield from walk(entry.path)
+            elif entry.is_file():
+                yield pathlib.Path(entry.path)
+
 def should_keep(path: pathlib.Path) -> bool:
     """Decide se o arquivo será incluído na concatenação."""
-    if any(part in SKIP_DIR for part in path.parts):
-        return False
     if path.name in KEEP_FILE:
         return True
     return path.suffix.lower() in KEEP_EXT
@@ -42,17 +52,19 @@ def banner(path: pathlib.Path) -> str:
 
 def main():
     base = pathlib.Path(__file__).resolve().parent
-    files = sorted(p for p in base.rglob("*") if p.is_file() and should_keep(p))
+    files = sorted(p for p in walk(base) if should_keep(p))
 
-    with OUT_FILE.open("w", encoding="utf-8") as out:
-        out.write(f"# DEBUG BUNDLE gerado em {datetime.datetime.now()}\n")
-        out.write("# Contém apenas arquivos relevantes para revisão.\n\n")
+    # binário: copia os bytes direto, sem decodificar/recodificar cada arquivo
+    with OUT_FILE.open("wb") as out:
+        out.write(f"# DEBUG BUNDLE gerado em {datetime.datetime.now()}\n".encode("utf-8"))
+        out.write("# Contém apenas arquivos relevantes para revisão.\n\n".encode("utf-8"))
 
         for f in files:
             try:
-                out.write(banner(f))
-                out.write(f.read_text(encoding="utf-8", errors="ignore"))
-                out.write("\n")  # garante quebra de linha final
+                out.write(banner(f).encode("utf-8"))
+                with f.open("rb") as src:
+                    shutil.copyfileobj(src, out, length=1 << 20)
+                out.write(b"\n")  # garante quebra de linha final
             except Exception as e:
                 print(f"[WARN] Não consegui ler {f}: {e}")
 
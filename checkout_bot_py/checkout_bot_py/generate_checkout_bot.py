@@ -13,6 +13,7 @@ Execute com:  python generate_checkout_bot.py
 """
 
 import os, subprocess, sys, textwrap, venv, pathlib, shutil
+from concurrent.futures import ThreadPoolExecutor
 
 APP_DIR = "checkout_bot_py"
 
@@ -126,7 +127,7 @@ async def checkout_endpoint(payload: Payload):
 fastapi==0.111.0
 uvicorn[standard]==0.29.0
 python-dotenv==1.0.1
-playwright==1.44.0
+playwright==1.49.1
 pydantic==2.7.1
     '''.strip(),
 
@@ -140,7 +141,11 @@ FROM python:3.11-slim
 WORKDIR /app
 COPY requirements.txt .
 RUN pip install --no-cache-dir -r requirements.txt && \
-    playwright install --with-deps chromium
+    playwright install --only-shell chromium && \
+    apt-get update && apt-get install -y --no-install-recommends \
+        libnss3 libnspr4 libatk1.0-0 libatk-bridge2.0-0 libcups2 libdrm2 libxkbcommon0 \
+        libxcomposite1 libxdamage1 libxfixes3 libxrandr2 libgbm1 libasound2 && \
+    rm -rf /var/lib/apt/lists/*
 COPY . .
 ENV PYTHONUNBUFFERED=1
 CMD ["uvicorn","app:app","--host","0.0.0.0","--port","8000"]
@@ -186,9 +191,21 @@ def create_venv_and_install():
     venv.EnvBuilder(with_pip=True).create(venv_dir)
     python_bin = venv_dir / ("Scripts\\python.exe" if os.name == "nt" else "bin/python")
     pip = [str(python_bin), "-m", "pip"]
-    subprocess.check_call(pip + ["install", "--upgrade", "pip"])
-    subprocess.check_call(pip + ["install", "-r", "requirements.txt"], cwd=APP_DIR)
-    subprocess.check_call([str(python_bin), "-m", "playwright", "install", "chromium"])
+    pip_install = pip + ["install", "--no-cache-dir", "--prefer-binary"]
+    env = {**os.environ, "PIP_DISABLE_PIP_VERSION_CHECK": "1"}
+    subprocess.check_call(pip + ["install", "--upgrade", "pip"], env=env)
+
+    # o CLI do playwright vem antes (um wheel só); depois o download do Chromium
+    # roda em paralelo com o resto do requirements.txt
+    playwright_pin = next(l for l in FILES["requirements.txt"].splitlines()
+                          if l.startswith("playwright"))
+    subprocess.check_call(pip_install + [playwright_pin], env=env)
+    commands = [
+        (pip_install + ["-r", "requirements.txt"], APP_DIR),
+        ([str(python_bin), "-m", "playwright", "install", "chromium"], None),
+    ]
+    with ThreadPoolExecutor(max_workers=len(commands)) as pool:
+        list(pool.map(lambda c: subprocess.check_call(c[0], cwd=c[1], env=env), commands))
     print("✅ Dependências instaladas.")
     activate = venv_dir / ("Scripts\\activate" if os.name == "nt" else "bin/activate")
     print(f"\n👉 Para iniciar:\n  cd {APP_DIR}\n  source {activate}\n  uvicorn app:app --reload\n")
@@ -6,12 +6,18 @@ def main():
         asyncio.set_event_loop_policy(
             asyncio.WindowsSelectorEventLoopPolicy()  # ← AQUI!
         )
+        loop = "asyncio"
+    else:
+        loop = "uvloop"                               # libuv: bem menos overhead de syscalls
 
+    prod = os.getenv("ENV") == "prod"
     uvicorn.run(
         "app:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,          # hot‑reload em dev
+        loop=loop,            # aplicado em cada worker, não só no processo pai
+        reload=not prod,      # hot‑reload em dev
+        workers=os.cpu_count() if prod else None,
     )
 
 # proteção obrigatória para multiprocessing no Windows